@@ -5,6 +5,11 @@ import plotly.graph_objects as go
 import matplotlib.pyplot as plt
 import seaborn as sns
 import streamlit.components.v1 as components
+from concurrent.futures import ThreadPoolExecutor
+from numpy.random import SFC64, Generator, SeedSequence
+from simulation_kernels import (dca_final, dca_path, fill_antithetic_normals, hold_final, hold_path, kernel_lock,
+                                monthly_params)
+
 
 st.set_page_config(
     page_title="Investment Strategy Simulator", 
@@ -52,13 +57,81 @@ with st.sidebar:
     bear_volatility = st.slider("Bear Market Volatility (%)", 0.0, 40.0, 18.0)
     simulations = st.number_input("Montecarlo simulation times", min_value=10, step=100, value=500)
 
-all_violin_data = []
 strategies = [
     "Continue Holding and Contributing",
     "Take Profit and Keep Contributing",
     "Take Profit, Keep Principal Only",
     "Stop Contributing, Hold Existing"
 ]
+contributing_strategies = {"Continue Holding and Contributing", "Take Profit and Keep Contributing"}
+take_profit_strategies = {"Take Profit, Keep Principal Only", "Take Profit and Keep Contributing"}
+# Runs at least this large draw their returns from independent streams in parallel.
+parallel_threshold = 10_000
+rng_streams = 4
+# Number of sample paths plotted per strategy.
+sample_path_count = 20
+
+
+@st.cache_data(max_entries=32)
+def run_simulation(principal, current_return_pct, monthly_dca, years, bear_years,
+                   expected_return, volatility, bear_return, bear_volatility, simulations):
+    """Simulate every strategy; returns final values, sample paths and the contribution series per strategy."""
+    initial_value = principal * (1 + current_return_pct / 100)
+    cost_basis = principal
+    monthly_return, monthly_std = monthly_params(expected_return, volatility)
+    bear_monthly_return, bear_monthly_std = monthly_params(bear_return, bear_volatility)
+
+    months = years * 12
+    bear_months = bear_years * 12
+    phase_months = [bear_months, months - bear_months]
+    # Draws and stored values are float32 to halve memory traffic; the kernels
+    # compound in float64. float32 holds whole TWD exactly only up to 2**24
+    # (~16.7M), so larger stored values are rounded to float32 spacing (a few
+    # TWD at 100M).
+    mu = np.repeat(np.array([bear_monthly_return, monthly_return], dtype=np.float32), phase_months)
+    sd = np.repeat(np.array([bear_monthly_std, monthly_std], dtype=np.float32), phase_months)
+    # Antithetic variates: each draw z is paired with -z, so only half the paths
+    # come from the RNG while percentiles use all `simulations` paths.
+    z = np.empty((simulations, months), dtype=np.float32)
+    if simulations >= parallel_threshold:
+        # Row blocks are filled from spawned SFC64 streams; NumPy releases the
+        # GIL while generating, so threads run concurrently.
+        rngs = [Generator(SFC64(seed)) for seed in SeedSequence(42).spawn(rng_streams)]
+        with ThreadPoolExecutor(max_workers=rng_streams) as pool:
+            list(pool.map(fill_antithetic_normals, rngs, np.array_split(z, rng_streams)))
+    else:
+        fill_antithetic_normals(Generator(SFC64(42)), z)
+    all_returns = z * sd + mu
+
+    final_values = np.empty((len(strategies), simulations), dtype=np.float32)
+    sample_paths = np.empty((len(strategies), min(sample_path_count, simulations), months + 1), dtype=np.float32)
+    # Contributions are the same on every path, so keep a single series per strategy.
+    contribution_series = np.empty((len(strategies), months + 1), dtype=np.float32)
+    for k, strategy in enumerate(strategies):
+        # Every strategy shares the same return draws; only the starting value and
+        # whether it keeps contributing differ.
+        contributes = strategy in contributing_strategies
+        reset = strategy in take_profit_strategies
+        start = np.float32(cost_basis if reset else initial_value)
+
+        samples = all_returns[:sample_paths.shape[1]]
+        # Month 0 is the value before any profit-taking, so a reset shows as a drop.
+        sample_paths[k, :, 0] = initial_value
+        with kernel_lock:
+            if contributes:
+                dca = np.float32(monthly_dca)
+                dca_path(samples, start, dca, out=sample_paths[k, :, 1:])
+                dca_final(all_returns, start, dca, out=final_values[k])
+            else:
+                hold_path(samples, start, out=sample_paths[k, :, 1:])
+                hold_final(all_returns, start, out=final_values[k])
+        if contributes:
+            contribution_series[k] = principal + monthly_dca * np.arange(months + 1)
+        else:
+            contribution_series[k] = principal
+
+    return final_values, sample_paths, contribution_series
+
 
 summary_stats = {}
 time_series_all_strategies = {}
@@ -67,57 +140,19 @@ final_value_all_strategies = {}
 
 st.markdown("### 📊 Strategy Comparison Results")
 
-for strategy in strategies:
-    initial_value = principal * (1 + current_return_pct / 100)
-    cost_basis = principal
-    monthly_return = expected_return / 100 / 12
-    monthly_std = volatility / 100 / np.sqrt(12)
-    bear_monthly_return = bear_return / 100 / 12
-    bear_monthly_std = bear_volatility / 100 / np.sqrt(12)
-
-    months = years * 12
-    bear_months = bear_years * 12
-    normal_months = months - bear_months
-    np.random.seed(42)
-    final_values = []
-    time_series_examples = []
-    contribution_series_examples = []
-
-    for _ in range(simulations):
-        value = initial_value
-        total_contribution = principal
-        time_series = [value]
-        contrib_series = [total_contribution]
-
-        if strategy in ["Take Profit, Keep Principal Only", "Take Profit and Keep Contributing"]:
-            value = cost_basis
-            total_contribution = cost_basis
-
-        bear_returns = np.random.normal(bear_monthly_return, bear_monthly_std, bear_months)
-        normal_returns = np.random.normal(monthly_return, monthly_std, normal_months)
-        all_returns = np.concatenate([bear_returns, normal_returns])
-
-        for r in all_returns:
-            if strategy in ["Continue Holding and Contributing", "Take Profit and Keep Contributing"]:
-                total_contribution += monthly_dca
-                value = (value + monthly_dca) * (1 + r)
-            else:
-                value = value * (1 + r)
+final_values_all, sample_paths_all, contribution_series_all = run_simulation(
+    principal, current_return_pct, monthly_dca, years, bear_years,
+    expected_return, volatility, bear_return, bear_volatility, simulations)
 
-            time_series.append(value)
-            contrib_series.append(total_contribution)
+# Lower-order-statistic percentiles from one partition over all strategies.
+percentile_idx = (np.array([0.10, 0.25, 0.50, 0.75, 0.90]) * (simulations - 1)).astype(int)
+percentiles_all = np.partition(final_values_all, percentile_idx, axis=1)[:, percentile_idx]
 
-        final_values.append(value)
-        if len(time_series_examples) < 20:
-            time_series_examples.append(time_series)
-            contribution_series_examples.append(contrib_series)
-
-    percentiles = np.percentile(final_values, [10, 25, 50, 75, 90])
-    summary_stats[strategy] = [f"{int(v):,}" for v in percentiles]
-    time_series_all_strategies[strategy] = time_series_examples
-    contribution_series_all_strategies[strategy] = contribution_series_examples
-    final_value_all_strategies[strategy] = final_values
-    all_violin_data.extend([(strategy, v) for v in final_values])
+for k, strategy in enumerate(strategies):
+    summary_stats[strategy] = [f"{int(v):,}" for v in percentiles_all[k]]
+    time_series_all_strategies[strategy] = sample_paths_all[k]
+    contribution_series_all_strategies[strategy] = contribution_series_all[k]
+    final_value_all_strategies[strategy] = final_values_all[k]
 
 result_df = pd.DataFrame(summary_stats, index=["10th %", "25th %", "50th %", "75th %", "90th %"]).T
 st.dataframe(result_df)
@@ -127,10 +162,14 @@ grid_rows = [st.columns(2), st.columns(2)]
 for i, strategy in enumerate(strategies):
     row = grid_rows[i // 2]
     with row[i % 2]:
+        paths = time_series_all_strategies[strategy]
+        # One WebGL trace for all sample paths, separated by NaN gaps.
+        xs = np.tile(np.append(np.arange(paths.shape[1]), np.nan), len(paths))
+        ys = np.hstack([paths, np.full((len(paths), 1), np.nan)]).ravel()
+
         fig = go.Figure()
-        for ts, cs in zip(time_series_all_strategies[strategy], contribution_series_all_strategies[strategy]):
-            fig.add_trace(go.Scatter(y=cs, mode='lines', name='Contribution', line=dict(dash='dot'), opacity=0.3))
-            fig.add_trace(go.Scatter(y=ts, mode='lines', name='Portfolio', opacity=0.3))
+        fig.add_trace(go.Scattergl(y=contribution_series_all_strategies[strategy], mode='lines', name='Contribution', line=dict(dash='dot'), opacity=0.3))
+        fig.add_trace(go.Scattergl(x=xs, y=ys, mode='lines', name='Portfolio', line=dict(color='rgba(0,0,200,0.3)')))
 
         fig.update_layout(title=f"{strategy}",
                           xaxis_title="Month",
@@ -140,7 +179,7 @@ for i, strategy in enumerate(strategies):
         st.plotly_chart(fig, use_container_width=True)
 
 st.markdown("### 🎻 Final Portfolio Value Distribution - Violin Chart")
-violin_df = pd.DataFrame(all_violin_data, columns=["Strategy", "Final Value"])
+violin_df = pd.DataFrame({"Strategy": np.repeat(strategies, simulations), "Final Value": final_values_all.ravel()})
 fig_violin, ax = plt.subplots(figsize=(12, 6))
 sns.violinplot(data=violin_df, x="Strategy", y="Final Value", ax=ax)
 ax.set_title("Distribution of Final Values by Strategy")
@@ -148,6 +187,7 @@ ax.set_ylabel("Final Portfolio Value (TWD)")
 ax.set_xlabel("Strategy")
 ax.tick_params(axis='x', rotation=20)
 st.pyplot(fig_violin)
+plt.close(fig_violin)
 
 
 
@@ -0,0 +1,70 @@
+"""Numba kernels and helpers for the Monte Carlo simulation.
+
+Kept out of the Streamlit script so the kernels are built once per process
+rather than on every rerun.
+"""
+import threading
+
+import numpy as np
+from numba import config, guvectorize
+
+# Pin the workqueue threading layer. Numba would otherwise pick tbb or omp
+# when installed, and a process that has run these kernels under tbb then
+# hangs at interpreter shutdown. Workqueue aborts the process when parallel
+# kernels are launched concurrently, and Streamlit runs each session's script
+# in its own thread, so callers hold this lock around every kernel call.
+config.THREADING_LAYER = "workqueue"
+kernel_lock = threading.Lock()
+
+
+# Each kernel compounds a single path; as gufuncs they loop over the
+# simulations axis in parallel. Paths are only materialized for the sampled
+# rows, every other path just reports its final value. Returns and outputs are
+# float32, but `value` is accumulated in float64: compounding in float32 drifts
+# by hundreds of TWD over 30 years on multi-million balances.
+@guvectorize(["void(f4[:], f4, f4, f4[:])"], "(m),(),()->(m)", target="parallel", fastmath=True, cache=True)
+def dca_path(returns, init, dca, out):
+    """Month-end values of one path, adding `dca` before each month's growth."""
+    value = np.float64(init)
+    for t in range(returns.shape[0]):
+        value = (value + dca) * (1.0 + returns[t])
+        out[t] = np.float32(value)
+
+
+@guvectorize(["void(f4[:], f4, f4, f4[:])"], "(m),(),()->()", target="parallel", fastmath=True, cache=True)
+def dca_final(returns, init, dca, out):
+    """Final value of one path, adding `dca` before each month's growth."""
+    value = np.float64(init)
+    for t in range(returns.shape[0]):
+        value = (value + dca) * (1.0 + returns[t])
+    out[0] = np.float32(value)
+
+
+@guvectorize(["void(f4[:], f4, f4[:])"], "(m),()->(m)", target="parallel", fastmath=True, cache=True)
+def hold_path(returns, init, out):
+    """Month-end values of one path without contributions."""
+    value = np.float64(init)
+    for t in range(returns.shape[0]):
+        value = value * (1.0 + returns[t])
+        out[t] = np.float32(value)
+
+
+@guvectorize(["void(f4[:], f4, f4[:])"], "(m),()->()", target="parallel", fastmath=True, cache=True)
+def hold_final(returns, init, out):
+    """Final value of one path without contributions."""
+    value = np.float64(init)
+    for t in range(returns.shape[0]):
+        value = value * (1.0 + returns[t])
+    out[0] = np.float32(value)
+
+
+def monthly_params(annual_return_pct, annual_volatility_pct):
+    """Convert an annual return and volatility in percent to a monthly mean and standard deviation."""
+    return annual_return_pct / 100 / 12, annual_volatility_pct / 100 / np.sqrt(12)
+
+
+def fill_antithetic_normals(rng, out):
+    """Fill `out` with float32 standard normals; the second half of the rows mirrors the first."""
+    half = (len(out) + 1) // 2
+    rng.standard_normal(out=out[:half], dtype=np.float32)
+    np.negative(out[:len(out) - half], out=out[half:])